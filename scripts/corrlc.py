@@ -3,33 +3,362 @@ import shutil
 import numpy as np
 from astropy.io import fits
 from astropy.table import Table
-import pxsas
+import sascache
 import time
+from concurrent.futures import ThreadPoolExecutor
+from lccatalog import record_source, catalog_db
+from workercache import qso_catalog_slice, set_sas_ccf
 
-def extract_lc(obs_id, lc_bin=1000):
+qso_catalog = '/data3/konakal/data/catalogs/qso_coords_new.csv'
+
+
+def load_qso_positions(obs_id):
+    # RA, DEC of the QSOs of this obsid, keyed on SDSS name
+    positions = {}
+    if not os.path.exists(qso_catalog):
+        return positions
+    for row in qso_catalog_slice(qso_catalog, obs_id):
+        positions[row['SDSS_NAME']] = (float(row['RA']), float(row['DEC']))
+    return positions
+
+
+def lc_total_counts(lc_file):
+    # Total counts in a light curve made with makeratecolumn=no
+    with fits.open(lc_file) as hdul:
+        return float(np.nansum(hdul[1].data['COUNTS']))
+
+
+# Detector-specific event selection. tag is inserted in the product file names (empty for PN,
+# which keeps the original names)
+detector_cuts = {
+    'PN': {'suffix': 'PIEVLI0000.FILTER', 'tag': '', 'q_flag': '#XMMEA_EP', 'n_pattern': 4,
+           'pi_min': 500, 'pi_max': 2000},
+    'MOS1': {'suffix': 'MIEVLI0000.FILTER', 'tag': 'M1', 'q_flag': '#XMMEA_EM', 'n_pattern': 12,
+             'pi_min': 500, 'pi_max': 2000},
+    'MOS2': {'suffix': 'MIEVLI0000.FILTER', 'tag': 'M2', 'q_flag': '#XMMEA_EM', 'n_pattern': 12,
+             'pi_min': 500, 'pi_max': 2000},
+}
+
+
+def find_event_files(work_dir, obs_id):
+    """
+    Find the filtered EPIC event lists of an obsid.
+
+    Returns a dict {detector: event file}, only with the detectors that have one.
+    """
+    event_files = {}
+    for file_name in sorted(os.listdir(work_dir)):
+        for detector, cuts in detector_cuts.items():
+            if detector in event_files or not file_name.endswith(cuts['suffix']):
+                continue
+            # MOS1 and MOS2 lists share the suffix, the instrument follows the obsid (P{obs_id}M1S001...)
+            if detector.startswith('MOS') and f"{obs_id}{cuts['tag']}" not in file_name:
+                continue
+            event_files[detector] = os.path.join(work_dir, file_name)
+    return event_files
+
+
+def common_time_range(event_files):
+    # Time span covering all event lists, so every detector is binned on the same grid
+    tstart, tstop = [], []
+    for eventfile in event_files.values():
+        header = fits.getheader(eventfile, 'EVENTS')
+        tstart.append(header['TSTART'])
+        tstop.append(header['TSTOP'])
+    return min(tstart), max(tstop)
+
+
+def combine_epic_lc(corrected_lc_files, output_file, time_range, lc_bin):
+    """
+    Combine the corrected light curves of several EPIC detectors into one.
+
+    All light curves are on the same time grid (same timemin and
+    timebinsize), so bins are matched by index. Rates are summed and errors
+    added in quadrature, only over bins valid in every detector.
+    """
+    bins = {}
+    for detector, lc_file in corrected_lc_files.items():
+        lc_data = Table.read(lc_file, hdu=1)
+        timedel = lc_data.meta.get('TIMEDEL', lc_bin)
+        timepixr = lc_data.meta.get('TIMEPIXR', 0.0)
+        # Bin start relative to timemin, in bins. The small offset only absorbs float error, it is far
+        # from a half bin so neighbouring bins can never map to the same index
+        bin_start = (np.asarray(lc_data['TIME']) - timepixr * timedel - time_range[0]) / timedel
+        index = np.floor(bin_start + 1e-3).astype(int)
+        bins[detector] = (index, lc_data)
+
+    common = None
+    for index, _ in bins.values():
+        common = index if common is None else np.intersect1d(common, index)
+    if common is None or len(common) == 0:
+        return None
+
+    rate = np.zeros(len(common))
+    error2 = np.zeros(len(common))
+    fracexp = np.ones(len(common))
+    time_col = None
+    for index, lc_data in bins.values():
+        rows = np.searchsorted(index, common)
+        rate += np.asarray(lc_data['RATE'])[rows]
+        error2 += np.asarray(lc_data['ERROR'])[rows] ** 2
+        fracexp = np.minimum(fracexp, np.asarray(lc_data['FRACEXP'])[rows])
+        if time_col is None:
+            time_col = np.asarray(lc_data['TIME'])[rows]
+
+    epic = Table()
+    epic['TIME'] = time_col
+    epic['RATE'] = rate
+    epic['ERROR'] = np.sqrt(error2)
+    epic['FRACEXP'] = fracexp
+    epic.meta['TIMEDEL'] = lc_bin
+    epic.meta['INSTRUME'] = '+'.join(corrected_lc_files)
+    epic.write(output_file, format='fits', overwrite=True)
+    return output_file
+
+
+def extract_source_lcs(obs_id, detector, eventfile, sdss_name, region_files, regions_dir, work_dir,
+                       output_dir, lc_bin, time_range):
+    """
+    Make the source, background and corrected light curves of one source for one detector.
+
+    Returns the products made, keyed on the results catalog column names.
+    """
+    source_lc_file = None
+    bkg_lc_file = None
+    cuts = detector_cuts[detector]
+    tag = cuts['tag']
+
+    # Products of this source and detector, in the columns of the results catalog
+    entry = {}
+
+    # Extract source light curve if available
+    if 'source' in region_files:
+        region_file = region_files['source']
+        region_path = os.path.join(regions_dir, region_file)
+
+        # Read region coordinates from the region file
+        with open(region_path, 'r') as f:
+            region_data = f.read()
+
+        # Extract coordinates from the source region file (x,y,radius)
+        coordinates = region_data.split('(')[1].split(')')[0].split(',')
+        x, y, r = coordinates[0], coordinates[1], coordinates[2]
+        entry['SRC_X'], entry['SRC_Y'], entry['SRC_R'] = float(x), float(y), float(r)
+
+        output_lc_file = f'{output_dir}{obs_id}_{sdss_name}_{tag}source.LC'
+
+        # Define the filtering expression
+        q_flag = cuts['q_flag']
+        n_pattern = cuts['n_pattern']
+        pi_min = cuts['pi_min']
+        pi_max = cuts['pi_max']
+        expression = f"{q_flag}&&(PATTERN<={n_pattern})&&((X,Y) IN circle({x},{y},{r}))&&(PI in [{pi_min}:{pi_max}])"
+
+        # Execute evselect to generate lc
+        try:
+            sascache.run(
+                "evselect",
+                outputs={'rateset': output_lc_file},
+                static_inputs=[eventfile],
+                table=eventfile,
+                energycolumn="PI",
+                withrateset="yes",
+                timebinsize=lc_bin,
+                timemin=time_range[0],
+                timemax=time_range[1],
+                maketimecolumn="yes",
+                makeratecolumn="no",  # Ensure COUNTS column is used instead of RATE column
+                expression=expression
+            )
+            print(f"Generated light curve for OBSID {obs_id}, SDSS {sdss_name}, {detector}, type: source")
+            source_lc_file = output_lc_file
+            entry['SRC_LC'] = source_lc_file
+            entry['SRC_COUNTS'] = lc_total_counts(source_lc_file)
+        except Exception as e:
+            print(f"Failed to generate source light curve for OBSID {obs_id}, SDSS {sdss_name}, {detector}. Error: {e}")
+
+    # Extract background light curve if available
+    if 'bkg' in region_files:
+        region_file = region_files['bkg']
+        region_path = os.path.join(regions_dir, region_file)
+
+        # Read region coordinates from the region file
+        with open(region_path, 'r') as f:
+            region_data = f.read()
+
+        # Extract coordinates from the background region file (x,y,inner,outer)
+        coordinates = region_data.split('(')[1].split(')')[0].split(',')
+        x, y, r_inner, r_outer = coordinates[0], coordinates[1], coordinates[2], coordinates[3]
+        r = r_outer
+        entry['BKG_X'], entry['BKG_Y'] = float(x), float(y)
+        entry['BKG_RIN'], entry['BKG_ROUT'] = float(r_inner), float(r_outer)
+        mask_file = os.path.join(work_dir, 'masks', region_file.replace('.reg', '.SRCMSK'))
+
+        # Create temporary directory for the mask file
+        temp_dir = os.path.join(output_dir, f'temp_mask_{detector}')
+        os.makedirs(temp_dir, exist_ok=True)
+        temp_mask_file = os.path.join(temp_dir, 'bkg.SRCMSK')
+
+        # Copy mask file to temporary directory with simple name
+        try:
+            shutil.copy(mask_file, temp_mask_file)
+        except Exception as e:
+            print(f"Failed to copy mask file {mask_file} to temporary directory. Error: {e}")
+            return entry
+
+        output_lc_file = f'{output_dir}{obs_id}_{sdss_name}_{tag}bkg.LC'
+
+        # Define filtering expression
+        q_flag = cuts['q_flag']
+        n_pattern = cuts['n_pattern']
+        pi_min = cuts['pi_min']
+        pi_max = cuts['pi_max']
+        expression = (
+            f"{q_flag}&&(PATTERN<={n_pattern})"
+            f"&&mask({temp_mask_file},0,0,X,Y)&&(PI in [{pi_min}:{pi_max}])&&(X,Y) in annulus({x},{y},{r_inner},{r})"
+        )
+
+        # Execute evselect
+        try:
+            sascache.run(
+                "evselect",
+                outputs={'rateset': output_lc_file},
+                inputs=[temp_mask_file],
+                static_inputs=[eventfile],
+                table=eventfile,
+                energycolumn="PI",
+                withrateset="yes",
+                timebinsize=lc_bin,
+                timemin=time_range[0],
+                timemax=time_range[1],
+                maketimecolumn="yes",
+                makeratecolumn="no",  # Ensure COUNTS column is used instead of RATE column
+                expression=expression
+            )
+            print(f"Generated light curve for OBSID {obs_id}, SDSS {sdss_name}, {detector}, type: bkg")
+            bkg_lc_file = output_lc_file
+            entry['BKG_LC'] = bkg_lc_file
+            entry['BKG_COUNTS'] = lc_total_counts(bkg_lc_file)
+        except Exception as e:
+            print(f"Failed to generate background light curve for OBSID {obs_id}, SDSS {sdss_name}, {detector}. Error: {e}")
+        finally:
+            # Clean up the temp directory
+            try:
+                shutil.rmtree(temp_dir)
+            except Exception as e:
+                print(f"Failed to remove temporary directory {temp_dir}. Error: {e}")
+
+    # Generate corrected light curve if both source and background light curves are available
+    if source_lc_file and bkg_lc_file:
+        # Create a temp directory for the light curve files
+        temp_lc_dir = os.path.join(output_dir, f'temp_lc_{detector}')
+        os.makedirs(temp_lc_dir, exist_ok=True)
+
+        # Copy source and background light curves to the temp directory with simpler names
+        temp_source_lc_file = os.path.join(temp_lc_dir, 'source.LC')
+        temp_bkg_lc_file = os.path.join(temp_lc_dir, 'bkg.LC')
+        try:
+            shutil.copy(source_lc_file, temp_source_lc_file)
+            shutil.copy(bkg_lc_file, temp_bkg_lc_file)
+        except Exception as e:
+            print(f"Failed to copy light curve files to temporary directory for corrected light curve. Error: {e}")
+            return entry
+
+        corrected_lc_file = f'{output_dir}{obs_id}_{sdss_name}_{tag}corrlc.LC'
+        try:
+            # The corrected light curve is filtered in place below, so it is copied out of the cache
+            sascache.run(
+                "epiclccorr",
+                outputs={'outset': corrected_lc_file},
+                inputs=[temp_source_lc_file, temp_bkg_lc_file],
+                static_inputs=[eventfile],
+                link=False,
+                srctslist=temp_source_lc_file,
+                eventlist=eventfile,
+                bkgtslist=temp_bkg_lc_file,
+                withbkgset="yes",
+                applyabsolutecorrections="yes"
+            )
+            print(f"Generated corrected light curve for OBSID {obs_id}, SDSS {sdss_name}, {detector}")
+
+            # Remove rows with FRACEXP v of 0 or NULL from corrected light curve
+            with fits.open(corrected_lc_file, mode='update') as hdul:
+                lc_data = Table(hdul[1].data)
+                valid_rows = lc_data['FRACEXP'] > 0
+                filtered_data = lc_data[valid_rows]
+                hdul[1].data = filtered_data.as_array()
+                print(f"Filtered out rows with FRACEXP = 0 or NULL in corrected light curve for OBSID {obs_id}, SDSS {sdss_name}, {detector}")
+
+                # Effective exposure of the remaining bins
+                timedel = hdul[1].header.get('TIMEDEL', lc_bin)
+                entry['CORR_LC'] = corrected_lc_file
+                entry['N_VALID_BINS'] = len(filtered_data)
+                entry['EXPOSURE'] = float(np.sum(filtered_data['FRACEXP']) * timedel)
+        except Exception as e:
+            print(f"Failed to generate corrected light curve for OBSID {obs_id}, SDSS {sdss_name}, {detector}. Error: {e}")
+        finally:
+            # Clean up the temporary directory after processing the corrected light curve
+            try:
+                shutil.rmtree(temp_lc_dir)
+            except Exception as e:
+                print(f"Failed to remove temporary directory {temp_lc_dir}. Error: {e}")
+
+    return entry
+
+
+def record_catalog_entry(obs_id, sdss_name, products, qso_positions, db_path):
+    # Row of the results catalog for one source, committed on its own
+    entry = {'SDSS_NAME': sdss_name, 'OBS_ID': obs_id}
+    if sdss_name in qso_positions:
+        entry['RA'], entry['DEC'] = qso_positions[sdss_name]
+    entry.update(products)
+    try:
+        record_source(entry, db_path)
+    except Exception as e:
+        print(f"Failed to update results catalog for OBSID {obs_id}, SDSS {sdss_name}. Error: {e}")
+
+
+def extract_detector_lcs(obs_id, detector, eventfile, region_dict, regions_dir, work_dir, output_dir, lc_bin,
+                         time_range, qso_positions=None, db_path=None):
+    """
+    Serial pass over all sources for one detector, run concurrently with the other detectors.
+
+    If db_path is given, the results catalog is updated as soon as each source is done.
+    """
+    products = {}
+    for sdss_name, region_files in region_dict.items():
+        try:
+            products[sdss_name] = extract_source_lcs(obs_id, detector, eventfile, sdss_name, region_files,
+                                                     regions_dir, work_dir, output_dir, lc_bin, time_range)
+        except Exception as e:
+            print(f"Failed to extract light curves for OBSID {obs_id}, SDSS {sdss_name}, {detector}. Error: {e}")
+            products[sdss_name] = {}
+
+        if db_path is not None:
+            record_catalog_entry(obs_id, sdss_name, products[sdss_name], qso_positions or {}, db_path)
+    return products
+
+
+def extract_lc(obs_id, lc_bin=1000, db_path=catalog_db):
     # Set up directories
     work_dir = f"/data3/konakal/data/proc/{obs_id}/{obs_id}/"
     output_dir = f"/data3/konakal/data/lc/{obs_id}/"
     os.makedirs(output_dir, exist_ok=True)
 
     # Set the SAS_CCF environment variable to the CCF file in the obsid directory
-    ccf_file = os.path.join(work_dir, 'ccf.cif')
-    if os.path.exists(ccf_file):
-        os.environ['SAS_CCF'] = ccf_file
-    else:
+    if set_sas_ccf(work_dir) is None:
         print(f"CCF file not found for OBSID {obs_id}. Proceeding without setting SAS_CCF.")
 
-    # Find event file in the obsid directory
-    eventfile = None
-    for file_name in os.listdir(work_dir):
-        if file_name.endswith("PIEVLI0000.FILTER"):
-            eventfile = os.path.join(work_dir, file_name)
-            break
+    # Find PN, MOS1 and MOS2 event files in the obsid directory
+    event_files = find_event_files(work_dir, obs_id)
 
-    if eventfile is None:
+    if not event_files:
         print(f"No event file found for OBSID {obs_id}.")
         return None
 
+    # Bin all detectors on the same time grid
+    time_range = common_time_range(event_files)
+
     # Iterate over all region files in the regions directory
     regions_dir = os.path.join(work_dir, 'regions')
     region_files = [f for f in os.listdir(regions_dir) if f.startswith(('src_', 'bkg_'))]
@@ -48,159 +377,42 @@ def extract_lc(obs_id, lc_bin=1000):
         sdss_name = '_'.join(region_file.split('_')[1:-1])
         region_dict.setdefault(sdss_name, {})[region_type] = region_file
 
-    for sdss_name, region_files in region_dict.items():
-        source_lc_file = None
-        bkg_lc_file = None
-
-        # Extract source light curve if available
-        if 'source' in region_files:
-            region_file = region_files['source']
-            region_path = os.path.join(regions_dir, region_file)
+    qso_positions = load_qso_positions(obs_id)
 
-            # Read region coordinates from the region file
-            with open(region_path, 'r') as f:
-                region_data = f.read()
+    # Regions and masks are in sky (X,Y) coordinates, shared by all detectors. The SAS tasks run as
+    # subprocesses, so one thread per detector is enough to run the detectors concurrently.
+    # The catalog holds the PN products and is written by the PN thread as each source finishes
+    with ThreadPoolExecutor(max_workers=len(event_files)) as executor:
+        futures = {detector: executor.submit(extract_detector_lcs, obs_id, detector, eventfile, region_dict,
+                                             regions_dir, work_dir, output_dir, lc_bin, time_range,
+                                             qso_positions, db_path if detector == 'PN' else None)
+                   for detector, eventfile in event_files.items()}
 
-            # Extract coordinates from the source region file (x,y,radius)
-            coordinates = region_data.split('(')[1].split(')')[0].split(',')
-            x, y, r = coordinates[0], coordinates[1], coordinates[2]
-
-            output_lc_file = f'{output_dir}{obs_id}_{sdss_name}_source.LC'
-
-            # Define the filtering expression
-            q_flag = "#XMMEA_EP"
-            n_pattern = 4
-            pn_pi_min = 500
-            pn_pi_max = 2000
-            expression = f"{q_flag}&&(PATTERN<={n_pattern})&&((X,Y) IN circle({x},{y},{r}))&&(PI in [{pn_pi_min}:{pn_pi_max}])"
-
-            # Execute evselect to generate lc
-            try:
-                pxsas.run(
-                    "evselect",
-                    table=eventfile,
-                    energycolumn="PI",
-                    withrateset="yes",
-                    rateset=output_lc_file,
-                    timebinsize=lc_bin,
-                    maketimecolumn="yes",
-                    makeratecolumn="no",  # Ensure COUNTS column is used instead of RATE column
-                    expression=expression
-                )
-                print(f"Generated light curve for OBSID {obs_id}, SDSS {sdss_name}, type: source")
-                source_lc_file = output_lc_file
-            except Exception as e:
-                print(f"Failed to generate source light curve for OBSID {obs_id}, SDSS {sdss_name}. Error: {e}")
-
-        # Extract background light curve if available
-        if 'bkg' in region_files:
-            region_file = region_files['bkg']
-            region_path = os.path.join(regions_dir, region_file)
-
-            # Read region coordinates from the region file
-            with open(region_path, 'r') as f:
-                region_data = f.read()
-
-            # Extract coordinates from the background region file (x,y,inner,outer)
-            coordinates = region_data.split('(')[1].split(')')[0].split(',')
-            x, y, r_inner, r_outer = coordinates[0], coordinates[1], coordinates[2], coordinates[3]
-            r = r_outer
-            mask_file = os.path.join(work_dir, 'masks', region_file.replace('.reg', '.SRCMSK'))
-
-            # Create temporary directory for the mask file
-            temp_dir = os.path.join(output_dir, 'temp_mask')
-            os.makedirs(temp_dir, exist_ok=True)
-            temp_mask_file = os.path.join(temp_dir, 'bkg.SRCMSK')
-
-            # Copy mask file to temporary directory with simple name
+        # A failing detector must not discard the products of the others
+        products = {}
+        for detector, future in futures.items():
             try:
-                shutil.copy(mask_file, temp_mask_file)
+                products[detector] = future.result()
             except Exception as e:
-                print(f"Failed to copy mask file {mask_file} to temporary directory. Error: {e}")
-                continue
-
-            output_lc_file = f'{output_dir}{obs_id}_{sdss_name}_bkg.LC'
+                print(f"Failed to extract {detector} light curves for OBSID {obs_id}. Error: {e}")
+                products[detector] = {}
 
-            # Define filtering expression
-            q_flag = "#XMMEA_EP"
-            n_pattern = 4
-            pn_pi_min = 500
-            pn_pi_max = 2000
-            expression = (
-                f"{q_flag}&&(PATTERN<={n_pattern})"
-                f"&&mask({temp_mask_file},0,0,X,Y)&&(PI in [{pn_pi_min}:{pn_pi_max}])&&(X,Y) in annulus({x},{y},{r_inner},{r})"
-            )
-
-            # Execute evselect
-            try:
-                pxsas.run(
-                    "evselect",
-                    table=eventfile,
-                    energycolumn="PI",
-                    withrateset="yes",
-                    rateset=output_lc_file,
-                    timebinsize=lc_bin,
-                    maketimecolumn="yes",
-                    makeratecolumn="no",  # Ensure COUNTS column is used instead of RATE column
-                    expression=expression
-                )
-                print(f"Generated light curve for OBSID {obs_id}, SDSS {sdss_name}, type: bkg")
-                bkg_lc_file = output_lc_file
-            except Exception as e:
-                print(f"Failed to generate background light curve for OBSID {obs_id}, SDSS {sdss_name}. Error: {e}")
-            finally:
-                # Clean up the temp directory
-                try:
-                    shutil.rmtree(temp_dir)
-                except Exception as e:
-                    print(f"Failed to remove temporary directory {temp_dir}. Error: {e}")
-
-        # Generate corrected light curve if both source and background light curves are available
-        if source_lc_file and bkg_lc_file:
-            # Create a temp directory for the light curve files
-            temp_lc_dir = os.path.join(output_dir, 'temp_lc')
-            os.makedirs(temp_lc_dir, exist_ok=True)
-
-            # Copy source and background light curves to the temp directory with simpler names
-            temp_source_lc_file = os.path.join(temp_lc_dir, 'source.LC')
-            temp_bkg_lc_file = os.path.join(temp_lc_dir, 'bkg.LC')
-            try:
-                shutil.copy(source_lc_file, temp_source_lc_file)
-                shutil.copy(bkg_lc_file, temp_bkg_lc_file)
-            except Exception as e:
-                print(f"Failed to copy light curve files to temporary directory for corrected light curve. Error: {e}")
-                continue
+    for sdss_name in region_dict:
+        # Without PN (or if its thread failed before a source) record the source position only
+        if sdss_name not in products.get('PN', {}):
+            record_catalog_entry(obs_id, sdss_name, {}, qso_positions, db_path)
 
-            corrected_lc_file = f'{output_dir}{obs_id}_{sdss_name}_corrlc.LC'
+        # Combined EPIC light curve from the detectors with a corrected light curve
+        corrected_lc_files = {detector: products[detector][sdss_name]['CORR_LC']
+                              for detector in event_files if 'CORR_LC' in products[detector].get(sdss_name, {})}
+        if len(corrected_lc_files) > 1:
+            epic_lc_file = f'{output_dir}{obs_id}_{sdss_name}_epiclc.LC'
             try:
-                pxsas.run(
-                    "epiclccorr",
-                    srctslist=temp_source_lc_file,
-                    eventlist=eventfile,
-                    outset=corrected_lc_file,
-                    bkgtslist=temp_bkg_lc_file,
-                    withbkgset="yes",
-                    applyabsolutecorrections="yes"
-                )
-                print(f"Generated corrected light curve for OBSID {obs_id}, SDSS {sdss_name}")
-
-                # Remove rows with FRACEXP v of 0 or NULL from corrected light curve
-                with fits.open(corrected_lc_file, mode='update') as hdul:
-                    lc_data = Table(hdul[1].data)
-                    valid_rows = lc_data['FRACEXP'] > 0
-                    filtered_data = lc_data[valid_rows]
-                    hdul[1].data = filtered_data.as_array()
-                    print(f"Filtered out rows with FRACEXP = 0 or NULL in corrected light curve for OBSID {obs_id}, SDSS {sdss_name}")
+                if combine_epic_lc(corrected_lc_files, epic_lc_file, time_range, lc_bin):
+                    print(f"Generated combined EPIC light curve ({', '.join(corrected_lc_files)}) for OBSID {obs_id}, SDSS {sdss_name}")
             except Exception as e:
-                print(f"Failed to generate corrected light curve for OBSID {obs_id}, SDSS {sdss_name}. Error: {e}")
-            finally:
-                # Clean up the temporary directory after processing the corrected light curve
-                try:
-                    shutil.rmtree(temp_lc_dir)
-                except Exception as e:
-                    print(f"Failed to remove temporary directory {temp_lc_dir}. Error: {e}")
+                print(f"Failed to generate combined EPIC light curve for OBSID {obs_id}, SDSS {sdss_name}. Error: {e}")
 
 if __name__ == "__main__":
     test_obsid = "0693540401" 
     extract_lc(test_obsid)
-
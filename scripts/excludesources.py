@@ -5,6 +5,7 @@ from xmmpype.utils.coordinates import phys2pix
 from regions import CirclePixelRegion
 from regions.core import PixCoord
 from astropy.wcs import WCS
+from workercache import image_wcs
 
 
 def exclude_regions(image_data, regions):
@@ -53,7 +54,7 @@ def create_sources_mask(obsid):
                         
                         # Convert physical detector coordinates to pixel coordinates using phys2pix
                         try:
-                            x_pix, y_pix, rpix = phys2pix(x_phys, y_phys, wcs=None, img=filter_image_path, rphys=radius_phys)
+                            x_pix, y_pix, rpix = phys2pix(x_phys, y_phys, wcs=image_wcs(filter_image_path), img=filter_image_path, rphys=radius_phys)
                         except Exception as e:
                             continue
 
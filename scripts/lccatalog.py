@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import time
+import numpy as np
+import healpy as hp
+
+# Consolidated catalog of light-curve products for the whole run
+catalog_db = '/data3/konakal/data/lc/lc_catalog.db'
+
+# HEALPix resolution used for the sky position index (nested, ~3.4 arcmin cells)
+hpx_nside = 1024
+
+columns = [
+    'SDSS_NAME', 'OBS_ID', 'RA', 'DEC', 'HPX',
+    'SRC_X', 'SRC_Y', 'SRC_R',
+    'BKG_X', 'BKG_Y', 'BKG_RIN', 'BKG_ROUT',
+    'SRC_COUNTS', 'BKG_COUNTS', 'EXPOSURE', 'N_VALID_BINS',
+    'SRC_LC', 'BKG_LC', 'CORR_LC', 'UPDATED',
+]
+
+schema = """
+CREATE TABLE IF NOT EXISTS lightcurves (
+    SDSS_NAME TEXT NOT NULL,
+    OBS_ID TEXT NOT NULL,
+    RA REAL,
+    DEC REAL,
+    HPX INTEGER,
+    SRC_X REAL,
+    SRC_Y REAL,
+    SRC_R REAL,
+    BKG_X REAL,
+    BKG_Y REAL,
+    BKG_RIN REAL,
+    BKG_ROUT REAL,
+    SRC_COUNTS REAL,
+    BKG_COUNTS REAL,
+    EXPOSURE REAL,
+    N_VALID_BINS INTEGER,
+    SRC_LC TEXT,
+    BKG_LC TEXT,
+    CORR_LC TEXT,
+    UPDATED REAL,
+    PRIMARY KEY (SDSS_NAME, OBS_ID)
+);
+CREATE INDEX IF NOT EXISTS idx_lightcurves_obsid ON lightcurves (OBS_ID);
+CREATE INDEX IF NOT EXISTS idx_lightcurves_hpx ON lightcurves (HPX);
+CREATE INDEX IF NOT EXISTS idx_lightcurves_counts ON lightcurves (SRC_COUNTS);
+"""
+
+
+def connect_catalog(db_path=catalog_db):
+    """
+    Open the light-curve catalog, creating the table and indices if needed.
+
+    Parameters:
+    - db_path (str): Path to the SQLite catalog file.
+    """
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+
+    # Several obsids are processed at once, so wait on locks instead of failing
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(schema)
+    return conn
+
+
+def sky_to_hpx(ra, dec):
+    # Nested HEALPix index of a sky position (degrees)
+    return int(hp.ang2pix(hpx_nside, ra, dec, nest=True, lonlat=True))
+
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    # Great-circle distance in arcsec between two sky positions (degrees), haversine form
+    ra1, dec1, ra2, dec2 = map(np.radians, (ra1, dec1, ra2, dec2))
+    a = np.sin((dec2 - dec1) / 2) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2
+    return np.degrees(2 * np.arcsin(np.sqrt(a))) * 3600.0
+
+
+def record_source(entry, db_path=catalog_db):
+    """
+    Insert or replace the catalog row of one source in one obsid.
+
+    Parameters:
+    - entry (dict): Values keyed on the catalog column names. SDSS_NAME and
+      OBS_ID are required, missing columns are stored as NULL.
+    - db_path (str): Path to the SQLite catalog file.
+    """
+    row = {column: entry.get(column) for column in columns}
+    if row['HPX'] is None and row['RA'] is not None and row['DEC'] is not None:
+        row['HPX'] = sky_to_hpx(row['RA'], row['DEC'])
+    row['UPDATED'] = time.time()
+
+    placeholders = ','.join(f':{column}' for column in columns)
+    conn = connect_catalog(db_path)
+    try:
+        # The row is committed as a single transaction (rolled back on error)
+        with conn:
+            conn.execute(f"INSERT OR REPLACE INTO lightcurves ({','.join(columns)}) VALUES ({placeholders})", row)
+    finally:
+        conn.close()
+
+
+def _query(sql, params=(), db_path=catalog_db):
+    conn = connect_catalog(db_path)
+    try:
+        return [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def query_source(sdss_name, db_path=catalog_db):
+    # All obsids in which a given QSO has light-curve products
+    return _query("SELECT * FROM lightcurves WHERE SDSS_NAME = ? ORDER BY OBS_ID", (sdss_name,), db_path)
+
+
+def query_obsid(obs_id, db_path=catalog_db):
+    # All QSOs with light-curve products in a given obsid
+    return _query("SELECT * FROM lightcurves WHERE OBS_ID = ? ORDER BY SDSS_NAME", (obs_id,), db_path)
+
+
+def query_counts(min_counts, db_path=catalog_db):
+    # All light curves with more than min_counts source counts
+    return _query("SELECT * FROM lightcurves WHERE SRC_COUNTS > ? ORDER BY SRC_COUNTS DESC", (min_counts,), db_path)
+
+
+def query_cone(ra, dec, radius_arcsec, db_path=catalog_db):
+    """
+    Return all catalog rows within radius_arcsec of (ra, dec).
+
+    The HEALPix index preselects candidate rows, the exact angular
+    separation is then applied to them.
+    """
+    vec = hp.ang2vec(ra, dec, lonlat=True)
+    pixels = hp.query_disc(hpx_nside, vec, np.radians(radius_arcsec / 3600.0), inclusive=True, nest=True)
+
+    rows = []
+    # Keep the number of SQL parameters well below the SQLite limit
+    for i in range(0, len(pixels), 500):
+        chunk = [int(p) for p in pixels[i:i + 500]]
+        placeholders = ','.join('?' * len(chunk))
+        rows += _query(f"SELECT * FROM lightcurves WHERE HPX IN ({placeholders})", chunk, db_path)
+
+    matches = []
+    for row in rows:
+        if angular_separation(ra, dec, row['RA'], row['DEC']) <= radius_arcsec:
+            matches.append(row)
+    return matches
+
+
+if __name__ == "__main__":
+    test_obsid = "0201900101"
+    for row in query_obsid(test_obsid):
+        print(row['SDSS_NAME'], row['SRC_COUNTS'], row['N_VALID_BINS'], row['CORR_LC'])
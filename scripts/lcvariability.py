@@ -0,0 +1,175 @@
+import os
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table
+from multiprocessing import Pool
+
+lc_root = '/data3/konakal/data/lc/'
+corrlc_suffix = '_corrlc.LC'
+
+
+def find_corrected_lcs(obs_ids=None, root=lc_root):
+    """
+    Collect the corrected light curves of some obsids, or of the whole run.
+
+    Parameters:
+    - obs_ids (list): OBS_IDs to include. None takes every obsid directory under root.
+    - root (str): Directory holding one light-curve directory per obsid.
+
+    Returns a list of (obs_id, sdss_name, lc_file) tuples.
+    """
+    if obs_ids is None:
+        obs_ids = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+
+    lc_list = []
+    for obs_id in obs_ids:
+        obs_dir = os.path.join(root, obs_id)
+        if not os.path.isdir(obs_dir):
+            continue
+        for file_name in sorted(os.listdir(obs_dir)):
+            if file_name.endswith(corrlc_suffix):
+                # Files are named {obs_id}_{sdss_name}_corrlc.LC
+                sdss_name = file_name[len(obs_id) + 1:-len(corrlc_suffix)]
+                lc_list.append((obs_id, sdss_name, os.path.join(obs_dir, file_name)))
+    return lc_list
+
+
+def read_rates(lc_file):
+    # RATE and ERROR columns of a corrected light curve, without NaN/NULL bins. Zero-count and
+    # zero-error bins are kept, they are valid data for the mean and the excess variance
+    try:
+        with fits.open(lc_file, memmap=True) as hdul:
+            rate = np.array(hdul[1].data['RATE'], dtype=float)
+            error = np.array(hdul[1].data['ERROR'], dtype=float)
+    except Exception as e:
+        print(f"Failed to read corrected light curve {lc_file}. Error: {e}")
+        return np.empty(0), np.empty(0)
+
+    valid = np.isfinite(rate) & np.isfinite(error)
+    return rate[valid], error[valid]
+
+
+def load_ragged(lc_files, ncores=1):
+    """
+    Load many light curves into ragged (concatenated) arrays.
+
+    Returns the concatenated rates and errors together with the number of
+    bins of each light curve, in the order of lc_files.
+    """
+    if ncores > 1:
+        with Pool(processes=ncores) as pool:
+            loaded = pool.map(read_rates, lc_files, chunksize=256)
+    else:
+        loaded = [read_rates(lc_file) for lc_file in lc_files]
+
+    n_bins = np.array([len(rate) for rate, _ in loaded], dtype=int)
+    if n_bins.sum() == 0:
+        return np.empty(0), np.empty(0), n_bins
+
+    rates = np.concatenate([rate for rate, _ in loaded])
+    errors = np.concatenate([error for _, error in loaded])
+    return rates, errors, n_bins
+
+
+def variability_statistics(rates, errors, n_bins):
+    """
+    Variability statistics of ragged light curves, in one vectorized pass.
+
+    Parameters:
+    - rates (ndarray): Concatenated count rates of all light curves.
+    - errors (ndarray): Concatenated 1-sigma rate errors.
+    - n_bins (ndarray): Number of bins of each light curve.
+
+    Returns a dict of per-light-curve arrays: MEAN_RATE, CHI2, DOF, NXS,
+    NXS_ERR, FVAR and MAX_MIN_RATIO. Light curves with fewer than two bins
+    get NaN. Zero-error bins are left out of CHI2 (and DOF) only.
+    """
+    n_lc = len(n_bins)
+    stats = {name: np.full(n_lc, np.nan) for name in
+             ('MEAN_RATE', 'CHI2', 'NXS', 'NXS_ERR', 'FVAR', 'MAX_MIN_RATIO')}
+    stats['DOF'] = np.maximum(n_bins - 1, 0)
+
+    # reduceat needs non-empty segments, so only light curves with >= 2 bins take part
+    use = n_bins >= 2
+    if not np.any(use):
+        return stats
+
+    keep = np.repeat(use, n_bins)
+    rates, errors = rates[keep], errors[keep]
+    n = n_bins[use].astype(float)
+    seg = np.concatenate([[0], np.cumsum(n_bins[use])[:-1]])
+    lc_index = np.repeat(np.arange(len(n)), n_bins[use])
+
+    mean = np.add.reduceat(rates, seg) / n
+    resid = rates - mean[lc_index]
+    err2 = errors ** 2
+
+    # Per-bin mask for the chi2 term, a zero error would make it infinite
+    has_err = err2 > 0
+    chi2 = np.add.reduceat(np.where(has_err, resid ** 2 / np.where(has_err, err2, 1.0), 0.0), seg)
+    n_chi2 = np.add.reduceat(has_err.astype(int), seg)
+    variance = np.add.reduceat(resid ** 2, seg) / (n - 1)
+    mean_err2 = np.add.reduceat(err2, seg) / n
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Normalized excess variance and its error (Vaughan et al. 2003, eq. 8 and 11)
+        nxs = (variance - mean_err2) / mean ** 2
+        fvar = np.where(nxs > 0, np.sqrt(np.clip(nxs, 0, None)), np.nan)
+        nxs_err = np.sqrt((np.sqrt(2.0 / n) * mean_err2 / mean ** 2) ** 2 +
+                          (np.sqrt(mean_err2 / n) * 2 * np.nan_to_num(fvar) / mean) ** 2)
+
+        max_rate = np.maximum.reduceat(rates, seg)
+        min_rate = np.minimum.reduceat(rates, seg)
+        ratio = np.where(min_rate > 0, max_rate / min_rate, np.nan)
+
+    stats['MEAN_RATE'][use] = mean
+    stats['CHI2'][use] = np.where(n_chi2 >= 2, chi2, np.nan)
+    stats['DOF'][use] = np.maximum(n_chi2 - 1, 0)
+    stats['NXS'][use] = nxs
+    stats['NXS_ERR'][use] = nxs_err
+    stats['FVAR'][use] = fvar
+    stats['MAX_MIN_RATIO'][use] = ratio
+    return stats
+
+
+def compute_variability(obs_ids=None, root=lc_root, output_file=None, ncores=1):
+    """
+    Compute variability statistics of all corrected light curves and write them to one table.
+
+    Parameters:
+    - obs_ids (list): OBS_IDs to include. None takes the whole run.
+    - root (str): Directory holding one light-curve directory per obsid.
+    - output_file (str): Output FITS table. Defaults to variability.fits in the
+      obsid directory for a single obsid, or in root otherwise.
+    - ncores (int): Number of processes used to read the light curves.
+    """
+    lc_list = find_corrected_lcs(obs_ids, root)
+    if output_file is None:
+        if obs_ids is not None and len(obs_ids) == 1:
+            output_file = os.path.join(root, obs_ids[0], 'variability.fits')
+        else:
+            output_file = os.path.join(root, 'variability.fits')
+
+    if not lc_list:
+        print(f"No corrected light curves found in {root} for OBSIDs {obs_ids}")
+        return None
+
+    rates, errors, n_bins = load_ragged([lc_file for _, _, lc_file in lc_list], ncores=ncores)
+    stats = variability_statistics(rates, errors, n_bins)
+
+    summary = Table()
+    summary['SDSS_NAME'] = [sdss_name for _, sdss_name, _ in lc_list]
+    summary['OBS_ID'] = [obs_id for obs_id, _, _ in lc_list]
+    summary['N_BINS'] = n_bins
+    for name in ('MEAN_RATE', 'CHI2', 'DOF', 'NXS', 'NXS_ERR', 'FVAR', 'MAX_MIN_RATIO'):
+        summary[name] = stats[name]
+    summary['LC_FILE'] = [lc_file for _, _, lc_file in lc_list]
+
+    summary.write(output_file, format='fits', overwrite=True)
+    print(f"Variability statistics for {len(summary)} light curves written to: {output_file}")
+    return summary
+
+
+if __name__ == "__main__":
+    test_obsid = "0693540401"
+    compute_variability([test_obsid])
@@ -2,6 +2,7 @@ import os
 import numpy as np
 from astropy.io import fits
 from xmmpype.utils.coordinates import phys2pix 
+from workercache import image_wcs
 
 
 def create_bkg_masks(obsid):
@@ -41,8 +42,9 @@ def create_bkg_masks(obsid):
 
                     # Convert physical coordinates to pixel coordinates
                     try:
-                        x_pix, y_pix, inner_radius_pix = phys2pix(x_phys, y_phys, img=filter_image_path, rphys=inner_radius_phys)
-                        _, _, outer_radius_pix = phys2pix(x_phys, y_phys, img=filter_image_path, rphys=outer_radius_phys)
+                        img_wcs = image_wcs(filter_image_path)
+                        x_pix, y_pix, inner_radius_pix = phys2pix(x_phys, y_phys, wcs=img_wcs, img=filter_image_path, rphys=inner_radius_phys)
+                        _, _, outer_radius_pix = phys2pix(x_phys, y_phys, wcs=img_wcs, img=filter_image_path, rphys=outer_radius_phys)
                     except Exception as e:
                         print(f"Error converting physical coordinates to pixel coordinates: {e}")
                         continue
@@ -1,8 +1,8 @@
 import os
-import csv
 from astropy.io import fits
 from astropy.wcs import WCS
 from xmmpype.utils.coordinates import sky2phys  
+from workercache import qso_catalog_slice, image_wcs
 
 # Set the fixed scaling factor: 1 pixel = 4 arcseconds
 arcsec_per_pixel = 4.0
@@ -22,10 +22,8 @@ def generate_qso_regions(obsid):
 
     img_fits_path = os.path.join(obsid_directory, img_file)
 
-    # Read the QSO catalog csv
-    with open(qso_catalog, 'r') as csvfile:
-        reader = csv.DictReader(csvfile)
-        qso_list = list(reader)
+    # Read the QSO catalog csv (rows of this obsid, cached per worker)
+    qso_list = qso_catalog_slice(qso_catalog, obsid)
 
     success_count = 0
     not_found_count = 0
@@ -38,7 +36,7 @@ def generate_qso_regions(obsid):
             sdss_name = qso_data['SDSS_NAME']
 
             # Convert RA, DEC to physical detector coordinates using sky2phys
-            x_pix, y_pix, _ = sky2phys([ra], [dec], wcs=None, img=img_fits_path, r=[arcsec_per_pixel])
+            x_pix, y_pix, _ = sky2phys([ra], [dec], wcs=image_wcs(img_fits_path), img=img_fits_path, r=[arcsec_per_pixel])
 
             # Create the regions directory
             regions_dir = os.path.join(obsid_directory, 'regions')
@@ -2,6 +2,7 @@ from astropy.table import Table
 from astropy.io import fits
 import os
 from xmmpype.utils.coordinates import sky2phys  
+from workercache import image_wcs
 
 def make_ds9regions(obsid):
     
@@ -30,7 +31,7 @@ def make_ds9regions(obsid):
         img_fits_path = os.path.join(obsid_directory, img_file)
 
         # Convert RA, DEC to detector coordinates (physical coordinates)
-        x, y, rphys = sky2phys(ra_values, dec_values, wcs=None, img=img_fits_path, r=radii_arcsec)
+        x, y, rphys = sky2phys(ra_values, dec_values, wcs=image_wcs(img_fits_path), img=img_fits_path, r=radii_arcsec)
 
         # Write the DS9 regions
         output_reg_file = os.path.join(obsid_directory, f'ds9_regions_{obsid}.reg')
@@ -0,0 +1,345 @@
+import os
+import csv
+import logging
+import threading
+import queue
+import numpy as np
+from astropy.io import fits
+from corrlc import find_event_files, qso_catalog
+from workercache import qso_catalog_slice
+
+# Measured runs used to calibrate the model, one row per processed obsid
+runs_file = '/home/konaka/xmmpype_extend/logs/memory_runs.csv'
+run_columns = ['OBS_ID', 'NPIX', 'NEVENTS', 'NSRC', 'PEAK_RSS_MB']
+
+# Model used until enough runs are measured: MB = const + per pixel + per event + per source.
+# Masks are float64 full-frame arrays (a few copies alive at once), events are read in full by SAS
+default_coeffs = np.array([1500.0, 4.0e-5, 1.0e-4, 2.0])
+default_npix = 648 * 648
+default_nevents = 2.0e6
+min_runs = 5
+
+# Predictions are scaled up so an underestimate does not push the host into swap
+safety_factor = 1.25
+
+
+def obsid_features(obsid):
+    """
+    Features of an obsid that drive its peak memory: image pixels, event count and source count.
+
+    Image pixels and event count only exist once the obsid is reduced, before
+    that they are None. The source count comes from the QSO catalog and is
+    always available.
+    """
+    obsid_dir = f'/data3/konakal/data/proc/{obsid}/{obsid}'
+    npix = None
+    nevents = None
+
+    if os.path.isdir(obsid_dir):
+        img_candidates = [f for f in os.listdir(obsid_dir) if f.endswith("PIEVLI0000_FULL.IMG")]
+        if img_candidates:
+            header = fits.getheader(os.path.join(obsid_dir, img_candidates[0]))
+            npix = header['NAXIS1'] * header['NAXIS2']
+
+        event_files = find_event_files(obsid_dir, obsid)
+        if event_files:
+            nevents = sum(fits.getheader(f, 'EVENTS')['NAXIS2'] for f in event_files.values())
+
+    nsrc = len(qso_catalog_slice(qso_catalog, obsid)) if os.path.exists(qso_catalog) else 0
+    return {'NPIX': npix, 'NEVENTS': nevents, 'NSRC': nsrc}
+
+
+def load_runs(path=runs_file):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as csvfile:
+        return [{k: float(v) if k != 'OBS_ID' else v for k, v in row.items()} for row in csv.DictReader(csvfile)]
+
+
+def create_runs_file(path=runs_file):
+    # Write the header of the calibration runs once, from the parent, before any worker appends to it
+    if not os.path.exists(path):
+        with open(path, 'w', newline='') as csvfile:
+            csv.DictWriter(csvfile, fieldnames=run_columns).writeheader()
+
+
+def record_run(obsid, peak_rss_mb, path=runs_file):
+    # Append the measured peak of a processed obsid to the calibration runs (header made by create_runs_file)
+    features = obsid_features(obsid)
+    if features['NPIX'] is None or features['NEVENTS'] is None:
+        return
+    with open(path, 'a', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=run_columns)
+        writer.writerow({'OBS_ID': obsid, 'PEAK_RSS_MB': f'{peak_rss_mb:.1f}', **features})
+
+
+class MemoryModel:
+    """
+    Linear model of the peak RSS (MB) of one obsid:
+
+        peak = c0 + c1 * NPIX + c2 * NEVENTS + c3 * NSRC
+
+    The coefficients are a non-negative least squares fit to the measured
+    runs, or default_coeffs while fewer than min_runs runs are available.
+
+    Before an obsid is reduced only NSRC is known, NPIX and NEVENTS are the
+    medians of the measured runs, so the prediction is coarse. It is refined
+    with the real values once the obsid is reduced (see reserve_reduced).
+    """
+
+    def __init__(self, runs=None):
+        self.runs = load_runs() if runs is None else runs
+        self.coeffs = default_coeffs
+        if len(self.runs) >= min_runs:
+            self.coeffs = self.fit(self.runs)
+
+        # Features of unreduced obsids default to the median of the measured runs
+        self.npix = np.median([r['NPIX'] for r in self.runs]) if self.runs else default_npix
+        self.nevents = np.median([r['NEVENTS'] for r in self.runs]) if self.runs else default_nevents
+
+    @staticmethod
+    def fit(runs):
+        design = np.array([[1.0, r['NPIX'], r['NEVENTS'], r['NSRC']] for r in runs])
+        peak = np.array([r['PEAK_RSS_MB'] for r in runs])
+        coeffs = np.linalg.lstsq(design, peak, rcond=None)[0]
+
+        # Refit without the terms that came out negative, memory does not shrink with more data
+        active = coeffs > 0
+        active[0] = True
+        coeffs = np.zeros(len(coeffs))
+        coeffs[active] = np.linalg.lstsq(design[:, active], peak, rcond=None)[0]
+        return np.clip(coeffs, 0, None)
+
+    def predict(self, obsid):
+        # Predicted peak RSS in MB, including the safety factor
+        features = obsid_features(obsid)
+        npix = features['NPIX'] if features['NPIX'] is not None else self.npix
+        nevents = features['NEVENTS'] if features['NEVENTS'] is not None else self.nevents
+        return safety_factor * float(np.dot(self.coeffs, [1.0, npix, nevents, features['NSRC']]))
+
+
+def _process_rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid):
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children += [int(c) for c in f.read().split()]
+    except OSError:
+        pass
+    return children
+
+
+def tree_rss_mb(pid=None):
+    # RSS of a process and all its descendants (SAS tasks run as child processes), Linux /proc only
+    pending = [pid or os.getpid()]
+    total_kb = 0
+    while pending:
+        p = pending.pop()
+        total_kb += _process_rss_kb(p)
+        pending += _children(p)
+    return total_kb / 1024.0
+
+
+class PeakRSSMonitor:
+    """
+    Context manager sampling the RSS of this process and its children in a background thread.
+
+    Long-lived workers cannot use ru_maxrss, which covers their whole lifetime
+    rather than one obsid.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, tree_rss_mb())
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, tree_rss_mb())
+        return self.peak_mb
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def default_memory_budget_mb(fraction=0.8):
+    # Fraction of the physical memory of the host
+    return fraction * os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024**2
+
+
+def process_alive(pid):
+    # False once a process has exited, including a killed worker the pool has not reaped yet (zombie)
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            state = f.read().rsplit(')', 1)[1].split()[0]
+    except (OSError, IndexError):
+        return False
+    return state not in ('Z', 'X')
+
+
+# Admission state shared by the launcher and the pool workers: the MB reserved by running obsids,
+# a condition to wait for memory to be released and a queue for worker messages to the launcher
+_admission = {}
+
+
+def create_admission_state(ctx, budget_mb):
+    ledger = ctx.Value('d', 0.0)
+    return {'ledger': ledger, 'cond': ctx.Condition(ledger.get_lock()), 'queue': ctx.Queue(),
+            'budget_mb': budget_mb}
+
+
+def init_admission(state):
+    # Called from the pool initializer, so the workers share the launcher's ledger
+    _admission.update(state)
+
+
+def _report(kind, obsid, reserved_mb):
+    if _admission:
+        _admission['queue'].put((kind, obsid, os.getpid(), reserved_mb))
+
+
+def report_start(obsid, reserved_mb):
+    # Tell the launcher which worker runs the obsid, so it can notice if the worker is killed
+    _report('start', obsid, reserved_mb)
+
+
+def reserve_reduced(obsid, reserved_mb, model=None):
+    """
+    Replace the coarse reservation of a running obsid by a prediction from its reduced data.
+
+    Call it after the reduction and before the memory-heavy stages (masks,
+    light curves). The worker waits until the new prediction fits in the
+    budget next to the other running obsids, or until nothing else holds
+    memory. The coarse reservation is given up while waiting, so two waiting
+    obsids can never block each other.
+
+    Returns the new reservation in MB.
+    """
+    if not _admission:
+        return reserved_mb
+    refined = (model or MemoryModel()).predict(obsid)
+    ledger, cond, budget_mb = _admission['ledger'], _admission['cond'], _admission['budget_mb']
+
+    with cond:
+        ledger.value -= reserved_mb
+        _report('reserve', obsid, 0.0)
+        cond.notify_all()
+        if ledger.value > 0 and ledger.value + refined > budget_mb:
+            logging.info(f"OBS_ID {obsid} waits for memory: predicted peak {refined:.0f} MB, "
+                         f"in use {ledger.value:.0f}/{budget_mb:.0f} MB")
+        while ledger.value > 0 and ledger.value + refined > budget_mb:
+            cond.wait(timeout=60)
+        ledger.value += refined
+        _report('reserve', obsid, refined)
+
+    logging.info(f"OBS_ID {obsid} reduced, predicted peak {reserved_mb:.0f} -> {refined:.0f} MB")
+    return refined
+
+
+def release(obsid, reserved_mb):
+    # Give back the reservation of a finished obsid
+    if not _admission:
+        return
+    with _admission['cond']:
+        _admission['ledger'].value -= reserved_mb
+        _report('reserve', obsid, 0.0)
+        _admission['cond'].notify_all()
+
+
+def run_with_admission(pool, func, obsids, state, processes, model=None, failed_result=None, poll=1.0):
+    """
+    Submit obsids to a pool only while the sum of their predicted peaks fits in the budget.
+
+    Obsids are admitted first-fit in the given order with their coarse
+    prediction, and func(obsid, reserved_mb) is expected to refine it with
+    reserve_reduced and to release it when done. One obsid is always admitted
+    when nothing is running, so the run cannot stall.
+
+    At most processes obsids (the size of the pool) are admitted at once. A
+    task queued behind busy workers would otherwise hold a reservation it
+    cannot use, and workers waiting in reserve_reduced could wait for it forever.
+
+    The pool never completes the task of a worker killed with SIGKILL (the
+    OOM killer), so the workers are watched through the pids they report.
+    Such an obsid is logged as an out-of-memory failure, its reservation is
+    freed and failed_result(obsid) is used as its result.
+
+    Returns the results of func in the order of obsids.
+    """
+    model = model or MemoryModel()
+    failed_result = failed_result or (lambda obsid: None)
+    ledger, cond, messages, budget_mb = state['ledger'], state['cond'], state['queue'], state['budget_mb']
+
+    predicted = {obsid: model.predict(obsid) for obsid in obsids}
+    pending = list(obsids)
+    running = {}
+    reserved = {}
+    pids = {}
+    results = {}
+
+    while pending or running:
+        with cond:
+            for obsid in list(pending):
+                if len(running) >= processes:
+                    break
+                if not running or ledger.value + predicted[obsid] <= budget_mb:
+                    logging.info(f"Admitting OBS_ID {obsid}: predicted peak {predicted[obsid]:.0f} MB, "
+                                 f"in use {ledger.value:.0f}/{budget_mb:.0f} MB")
+                    ledger.value += predicted[obsid]
+                    reserved[obsid] = predicted[obsid]
+                    running[obsid] = pool.apply_async(func, (obsid, predicted[obsid]))
+                    pending.remove(obsid)
+
+        # Worker pids and reservation changes, in the order the workers sent them
+        while True:
+            try:
+                kind, obsid, pid, reserved_mb = messages.get_nowait()
+            except queue.Empty:
+                break
+            pids[obsid] = pid
+            if kind == 'reserve':
+                reserved[obsid] = reserved_mb
+
+        for obsid, async_result in list(running.items()):
+            if async_result.ready():
+                results[obsid] = async_result.get()
+                del running[obsid]
+            elif obsid in pids and not process_alive(pids[obsid]):
+                logging.error(f"Failed processing for OBS_ID: {obsid}, worker {pids[obsid]} was killed "
+                              f"(likely out of memory, predicted peak {reserved.get(obsid, predicted[obsid]):.0f} MB)")
+                with cond:
+                    ledger.value -= reserved.get(obsid, 0.0)
+                    cond.notify_all()
+                results[obsid] = failed_result(obsid)
+                del running[obsid]
+
+        with cond:
+            cond.wait(timeout=poll)
+
+    return [results[obsid] for obsid in obsids]
@@ -1,4 +1,5 @@
 import logging
+import logging.handlers
 import csv
 import xmmpype as xmm
 from xmmpype.crossmatch import XMatch
@@ -10,16 +11,47 @@ from makeqsoreg import generate_qso_regions
 from excludesources import exclude_regions, create_sources_mask
 from makebkgmask import create_bkg_masks
 from corrlc import extract_lc
+from lcvariability import compute_variability, lc_root
+from workercache import log_cache_stats
+import sascache
+from memmodel import (PeakRSSMonitor, MemoryModel, create_runs_file, record_run, default_memory_budget_mb,
+                      create_admission_state, init_admission, report_start, reserve_reduced, release,
+                      run_with_admission)
 import os
 import shutil
-from multiprocessing import Pool
+import multiprocessing
 import time
 
+# Modules imported once in the forkserver and inherited by every warm worker
+preload_modules = ['numpy', 'astropy.io.fits', 'astropy.table', 'astropy.wcs', 'regions', 'pxsas',
+                   'xmmpype', 'xmmpype.crossmatch', 'xmmpype.hpixels', 'xmmpype.obsids', 'xmmpype.events',
+                   'makesrclist', 'makereg', 'makeqsoreg', 'excludesources', 'makebkgmask', 'corrlc',
+                   'lcvariability', 'lccatalog', 'workercache', 'sascache', 'memmodel']
+
+pipeline_log = '/home/konaka/xmmpype_extend/logs/pipeline.log'
+
+# Function run once in every worker when the pool starts
+def init_worker(pool_start_time, admission_state, log_queue):
+    # forkserver workers do not inherit the handlers of the parent. Send their records to the parent, which
+    # writes them with its own handlers, so the workers never write to pipeline.log at another file offset
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.info(f"Worker {os.getpid()} started in {time.time() - pool_start_time:.2f} seconds")
+
+    # Memory ledger shared with the launcher
+    init_admission(admission_state)
+
 # Function to process each obsid independently
-def process_obsid(obsid):
+def process_obsid(obsid, reserved_mb=0.0):
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
     start_time = time.time()  # Start timing
+    report_start(obsid, reserved_mb)
+    # Peak memory of this obsid (worker plus SAS child processes), used to calibrate the memory model
+    monitor = PeakRSSMonitor().start()
     try:
         # Define project
         project_name = f"{obsid}"
@@ -33,6 +65,9 @@ def process_obsid(obsid):
         # Reduce the obsid
         P.reduce_obsids(ncores=2)
 
+        # Image size and event count are known now, wait until their predicted peak fits in the memory budget
+        reserved_mb = reserve_reduced(obsid, reserved_mb)
+
         # Define the HEALPix grid for the single obsid
         hpixels = P.calc_hpixels()
 
@@ -69,6 +104,9 @@ def process_obsid(obsid):
         # Extract Source, Background and Corrected lightcurves for each source
         extract_lc(obsid, lc_bin=1000)
 
+        # Variability statistics of all corrected lightcurves of the obsid
+        compute_variability([obsid])
+
         # Log successful processing
         logger.info(f"Completed processing for OBS_ID: {obsid}")
 
@@ -97,12 +135,34 @@ def process_obsid(obsid):
         elapsed_time = end_time - start_time
         logger.info(f"Processing time for OBS_ID {obsid}: {elapsed_time:.2f} seconds")
 
+        peak_rss_mb = monitor.stop()
+        logger.info(f"Peak memory for OBS_ID {obsid}: {peak_rss_mb:.0f} MB")
+        # The obsid is done, failing to store its calibration run must not turn it into a failure
+        try:
+            record_run(obsid, peak_rss_mb)
+        except Exception as e:
+            logger.warning(f"Failed to record memory run for OBS_ID {obsid}. Error: {e}")
+
+        # Per-worker cache hit/miss numbers, accumulated over all obsids this worker has run
+        log_cache_stats(logger)
+        sascache.log_stats(logger)
+
         return obsid, True, elapsed_time  # Return success and elapsed time
 
+    # Python-level allocation failures only, a worker killed by the OOM killer is detected by the launcher
+    except MemoryError:
+        peak_rss_mb = monitor.stop()
+        logger.error(f"Failed processing for OBS_ID: {obsid}, out of memory (peak seen {peak_rss_mb:.0f} MB)")
+        return obsid, False, None  # Return failure
+
     except Exception as e:
+        monitor.stop()
         logger.error(f"Failed processing for OBS_ID: {obsid} with error: {e}")
         return obsid, False, None  # Return failure
 
+    finally:
+        release(obsid, reserved_mb)
+
 # Function to get obsids from QSO CSV 
 def get_obsids_from_csv(file_path, max_obsids=None):
     obsids = set()
@@ -116,7 +176,8 @@ def get_obsids_from_csv(file_path, max_obsids=None):
 
 if __name__ == "__main__":
     # Set up logging
-    logging.basicConfig(level=logging.INFO, filename='/home/konaka/xmmpype_extend/logs/pipeline.log', filemode='w',
+    # force=True, importing makesrclist already configured the root logger
+    logging.basicConfig(level=logging.INFO, filename=pipeline_log, filemode='w', force=True,
                         format='%(asctime)s - %(levelname)s - %(message)s')
     console = logging.StreamHandler()
     console.setLevel(logging.INFO)
@@ -137,19 +198,38 @@ if __name__ == "__main__":
     # Remove duplicates that exist in both lists
     obsids_from_csv = list(set(obsids_from_csv))
 
+    # Obsids are only started while the sum of their predicted peak memory fits in this budget (MB)
+    memory_budget_mb = default_memory_budget_mb()  # 80% of physical memory
+    n_workers = 4  # Obsids processed at once
+    create_runs_file()
+
     start_time_total = time.time()  # Start total processing time
 
     try:
-        pool = Pool(processes=4)
-        results = pool.map(process_obsid, obsids_from_csv)
+        # Long-lived workers forked from a server with the heavy imports preloaded
+        ctx = multiprocessing.get_context('forkserver')
+        ctx.set_forkserver_preload(preload_modules)
+        admission_state = create_admission_state(ctx, memory_budget_mb)
+
+        # Worker log records are written by the parent's handlers (pipeline log and console)
+        log_queue = ctx.Queue()
+        log_listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers,
+                                                      respect_handler_level=True)
+        log_listener.start()
+
+        pool = ctx.Pool(processes=n_workers, initializer=init_worker, initargs=(time.time(), admission_state, log_queue))
+        results = run_with_admission(pool, process_obsid, obsids_from_csv, admission_state, n_workers,
+                                     model=MemoryModel(), failed_result=lambda obsid: (obsid, False, None))
     except KeyboardInterrupt:
         # Close all running processes if CTRL+C is pressed
-        pool.close()
+        pool.terminate()
         pool.join()
     finally:
-        # To make sure processes are closed in the end, even if errors happen
-        pool.close()
+        # To make sure processes are closed in the end, even if errors happen. All results are in at this
+        # point, and close() would wait forever on the task of a worker killed by the OOM killer
+        pool.terminate()
         pool.join()
+        log_listener.stop()
 
     # Tracking processed, failed OBS_IDs and calculating average time
     processed_obsids = [obsid for obsid, success, _ in results if success]
@@ -162,6 +242,10 @@ if __name__ == "__main__":
     failed_count = len(failed_obsids)
     remaining_count = total_obsids - processed_count - failed_count
 
+    # Variability statistics over the corrected lightcurves of the whole run
+    if processed_obsids:
+        compute_variability(processed_obsids, output_file=os.path.join(lc_root, 'variability.fits'), ncores=4)
+
     end_time_total = time.time()  # End total processing time
     total_elapsed_time = end_time_total - start_time_total
 
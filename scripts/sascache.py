@@ -0,0 +1,188 @@
+import os
+import shutil
+import hashlib
+import logging
+import subprocess
+from functools import lru_cache
+import pxsas
+
+# Content-addressed store of SAS task outputs
+cache_dir = '/data3/konakal/data/sascache/'
+max_cache_bytes = 50 * 1024**3
+evict_every = 20
+
+# Hit/miss numbers of this process
+stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(16 * 1024**2), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=64)
+def _memo_digest(path, size, mtime_ns):
+    # size and mtime_ns are part of the key so a rewritten file is hashed again
+    return _hash_file(path)
+
+
+def file_digest(path, memoize=False):
+    """
+    sha256 of the contents of a file.
+
+    memoize=True reuses the digest while the path, size and mtime are
+    unchanged. Only use it for large files that are not rewritten during a
+    run (event lists, CCF). Small temp inputs reuse their names for every
+    source with the same size and possibly the same coarse mtime, so they
+    are always hashed.
+    """
+    if not memoize:
+        return _hash_file(path)
+    st = os.stat(path)
+    return _memo_digest(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+@lru_cache(maxsize=1)
+def sas_version():
+    # SAS installation and version, so products of an older SAS are not reused after an upgrade
+    try:
+        version = subprocess.run(['sasversion'], capture_output=True, text=True, timeout=60).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        version = ''
+    return f"{os.environ.get('SAS_DIR', '')}|{version}"
+
+
+def task_key(task, params, inputs, outputs, static_inputs=()):
+    """
+    Hash of a SAS task invocation.
+
+    Input file paths are replaced by the hash of their contents and output
+    paths by their parameter name, so the key does not depend on where the
+    files live. The CCF pointed to by SAS_CCF and the SAS version are hashed
+    along with them.
+    """
+    replace = {path: f"<in:{file_digest(path)}>" for path in inputs}
+    replace.update({path: f"<in:{file_digest(path, memoize=True)}>" for path in static_inputs})
+    replace.update({path: f"<out:{name}>" for name, path in outputs.items()})
+
+    h = hashlib.sha256()
+    h.update(sas_version().encode())
+    h.update(task.encode())
+    for name in sorted(params):
+        value = str(params[name])
+        # Longest paths first so a path is never partially replaced by one of its prefixes
+        for path in sorted(replace, key=len, reverse=True):
+            value = value.replace(path, replace[path])
+        h.update(f"\0{name}={value}".encode())
+
+    ccf_file = os.environ.get('SAS_CCF')
+    if ccf_file and os.path.exists(ccf_file):
+        h.update(f"\0SAS_CCF={file_digest(ccf_file, memoize=True)}".encode())
+    return h.hexdigest()
+
+
+def _place(src, dst, link):
+    # Never write through an existing file, it may be a hardlink into the cache
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def evict(max_bytes=max_cache_bytes):
+    """
+    Remove least recently used cache entries until the cache fits in max_bytes.
+    """
+    entries = []
+    total = 0
+    for key in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, key)
+        if key.startswith('tmp_') or not os.path.isdir(entry_dir):
+            continue
+        size = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+        entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+        total += size
+
+    for _, size, entry_dir in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+        stats['evictions'] += 1
+
+
+def run(task, outputs, inputs=(), static_inputs=(), link=True, **params):
+    """
+    Memoized pxsas.run.
+
+    Parameters:
+    - task (str): SAS task name.
+    - outputs (dict): Output file parameters of the task, {parameter name: path}.
+      They are passed to the task together with params.
+    - inputs (list): Files read by the task, including files only referenced
+      inside other parameters (e.g. a mask in an expression). Hashed on every call.
+    - static_inputs (list): Large input files not rewritten during a run (event
+      lists). Their digest is computed once per file version.
+    - link (bool): Hardlink outputs from the cache instead of copying them.
+      Use False for outputs that are modified in place afterwards.
+    - params: All other task parameters.
+
+    On a hit the cached outputs are placed at the output paths and the task
+    is not run. On a miss the task is run and its outputs are added to the cache.
+    """
+    key = task_key(task, params, inputs, outputs, static_inputs)
+    entry_dir = os.path.join(cache_dir, key)
+
+    if all(os.path.exists(os.path.join(entry_dir, name)) for name in outputs):
+        try:
+            for name, path in outputs.items():
+                _place(os.path.join(entry_dir, name), path, link)
+            # Touch the entry so eviction sees it as recently used
+            os.utime(entry_dir)
+            stats['hits'] += 1
+            logging.info(f"SAS cache hit for {task} ({key[:12]})")
+            return
+        except OSError as e:
+            # The entry was evicted by another worker meanwhile, run the task instead
+            logging.info(f"SAS cache entry {key[:12]} for {task} vanished, running the task. Error: {e}")
+
+    stats['misses'] += 1
+    for path in outputs.values():
+        if os.path.lexists(path):
+            os.remove(path)
+    pxsas.run(task, **params, **outputs)
+
+    # Fill a private directory first and rename it, so other workers never see a partial entry
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = os.path.join(cache_dir, f"tmp_{key}_{os.getpid()}")
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        for name, path in outputs.items():
+            shutil.copy2(path, os.path.join(tmp_dir, name))
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # Another worker stored the same entry first
+        pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # Walking the whole cache is not free, so only check its size every few misses
+    if stats['misses'] % evict_every == 0:
+        try:
+            evict()
+        except OSError as e:
+            logging.warning(f"SAS cache eviction failed. Error: {e}")
+
+
+def log_stats(logger=None):
+    logger = logger or logging.getLogger()
+    logger.info(f"SAS cache (pid {os.getpid()}): hits={stats['hits']} misses={stats['misses']} "
+                f"evictions={stats['evictions']}")
@@ -0,0 +1,98 @@
+import os
+import csv
+import logging
+from functools import lru_cache
+from astropy.io import fits
+from astropy.wcs import WCS
+
+# Bounds of the per-worker caches, kept across obsids by long-lived workers
+catalog_cache_size = 4
+wcs_cache_size = 32
+ccf_cache_size = 256
+
+
+@lru_cache(maxsize=catalog_cache_size)
+def _read_qso_catalog(catalog_path, mtime):
+    # Whole QSO catalog grouped by OBS_ID. mtime is part of the key so an edited catalog is re-read
+    by_obsid = {}
+    with open(catalog_path, 'r') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            by_obsid.setdefault(row['OBS_ID'], []).append(row)
+    return by_obsid
+
+
+def qso_catalog_slice(catalog_path, obsid):
+    """
+    Rows of the QSO catalog csv belonging to one obsid.
+
+    The whole catalog is parsed once per worker and per file version and
+    reused for every obsid and pipeline step, only the slice lookup is redone.
+
+    Parameters:
+    - catalog_path (str): Path to the QSO catalog csv.
+    - obsid (str): OBS_ID to select.
+    """
+    return tuple(_read_qso_catalog(catalog_path, os.path.getmtime(catalog_path)).get(obsid, ()))
+
+
+@lru_cache(maxsize=wcs_cache_size)
+def _read_image_wcs(img_path, mtime):
+    # mtime is part of the key so a rewritten image is parsed again
+    return WCS(fits.getheader(img_path))
+
+
+def image_wcs(img_path):
+    """
+    Parsed WCS of an image, for the wcs= argument of sky2phys/phys2pix.
+
+    The header is parsed once per image version instead of once per source
+    and per pipeline step.
+    """
+    return _read_image_wcs(img_path, os.path.getmtime(img_path))
+
+
+@lru_cache(maxsize=ccf_cache_size)
+def _locate_ccf(work_dir):
+    # Raises when ccf.cif is missing: lru_cache does not store exceptions, so only found CCFs are cached
+    ccf_file = os.path.join(work_dir, 'ccf.cif')
+    if not os.path.exists(ccf_file):
+        raise FileNotFoundError(ccf_file)
+    return ccf_file
+
+
+def find_ccf(work_dir):
+    # Path of the CCF index file of an obsid, None if it does not exist (looked up again later, it may appear)
+    try:
+        return _locate_ccf(work_dir)
+    except FileNotFoundError:
+        return None
+
+
+def set_sas_ccf(work_dir):
+    """
+    Point SAS_CCF to the CCF of an obsid, only touching the environment when it changes.
+
+    Returns the CCF path, or None if the obsid has no ccf.cif.
+    """
+    ccf_file = find_ccf(work_dir)
+    if ccf_file is not None and os.environ.get('SAS_CCF') != ccf_file:
+        os.environ['SAS_CCF'] = ccf_file
+    return ccf_file
+
+
+def cache_stats():
+    # Hit/miss numbers of all worker caches
+    caches = {
+        'qso_catalog': _read_qso_catalog,
+        'image_wcs': _read_image_wcs,
+        'ccf': _locate_ccf,
+    }
+    return {name: func.cache_info() for name, func in caches.items()}
+
+
+def log_cache_stats(logger=None):
+    logger = logger or logging.getLogger()
+    for name, info in cache_stats().items():
+        logger.info(f"Worker {os.getpid()} cache {name}: hits={info.hits} misses={info.misses} "
+                    f"size={info.currsize}/{info.maxsize}")